@@ -1,37 +1,71 @@
 import json
 import os
+from functools import wraps
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 ADMINS_FILE = "admins.json"
 HARDCODED_ADMINS = {"@SadeshaHansana2", "@Sadesha_Hansana"}
 
-def load_dynamic_admins():
-    """Loads dynamic admins from admins.json."""
+# Heroku compatibility: load admins from environment variable (fixed for the process lifetime)
+_ENV_ADMINS = frozenset(admin.strip() for admin in os.environ.get("EXTRA_ADMINS", "").split(",") if admin.strip())
+_STATIC_ADMINS = frozenset(HARDCODED_ADMINS) | _ENV_ADMINS
+
+# Parsed admins.json keyed by its mtime; 'all' caches the get_all_admins() result.
+_admin_cache = {'mtime': 0, 'data': set(), 'all': None}
+
+def _get_admins_mtime():
+    try:
+        return os.stat(ADMINS_FILE).st_mtime
+    except OSError:
+        return 0
+
+def _read_dynamic_admins():
+    """Reads and parses admins.json."""
     if not os.path.exists(ADMINS_FILE):
         return set()
     try:
-        with open(ADMINS_FILE, "r") as f:
-            data = json.load(f)
-            return set(data.get("admins", []))
+        with open(ADMINS_FILE, "rb") as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+        return set(data.get("admins", []))
     except (json.JSONDecodeError, Exception):
         return set()
 
+def _refresh_admin_cache():
+    """Re-reads admins.json only if it changed since the last read."""
+    mtime = _get_admins_mtime()
+    if mtime != _admin_cache['mtime']:
+        _admin_cache['data'] = _read_dynamic_admins()
+        _admin_cache['mtime'] = mtime
+        _admin_cache['all'] = None
+
+def load_dynamic_admins():
+    """Loads dynamic admins from admins.json."""
+    _refresh_admin_cache()
+    return set(_admin_cache['data'])
+
 def save_dynamic_admins(admins):
     """Saves dynamic admins to admins.json."""
-    with open(ADMINS_FILE, "w") as f:
-        json.dump({"admins": list(admins)}, f, indent=4)
+    if orjson:
+        with open(ADMINS_FILE, "wb") as f:
+            f.write(orjson.dumps({"admins": list(admins)}, option=orjson.OPT_INDENT_2))
+    else:
+        with open(ADMINS_FILE, "w") as f:
+            json.dump({"admins": list(admins)}, f, indent=4)
+    _admin_cache['data'] = set(admins)
+    _admin_cache['mtime'] = _get_admins_mtime()
+    _admin_cache['all'] = None
 
 def get_all_admins():
-    """Returns a set of all admins (hardcoded + dynamic + environment)."""
-    dynamic_admins = load_dynamic_admins()
-    all_admins = HARDCODED_ADMINS.union(dynamic_admins)
-    
-    # Heroku compatibility: load admins from environment variable
-    env_admins = os.environ.get("EXTRA_ADMINS", "")
-    if env_admins:
-        extra = {admin.strip() for admin in env_admins.split(",") if admin.strip()}
-        all_admins = all_admins.union(extra)
-        
-    return all_admins
+    """Returns a frozenset of all admins (hardcoded + dynamic + environment)."""
+    _refresh_admin_cache()
+    if _admin_cache['all'] is None:
+        _admin_cache['all'] = _STATIC_ADMINS | _admin_cache['data']
+    return _admin_cache['all']
 
 def is_admin(username):
     """Checks if a username is in the admin list."""
@@ -41,8 +75,30 @@ def is_admin(username):
     if not username.startswith("@") and not username.isdigit():
         username = f"@{username}"
     
-    all_admins = get_all_admins()
-    return username in all_admins
+    return username in get_all_admins()
+
+def get_username(update):
+    """Returns the @username (or numeric id) of the update's sender."""
+    user = update.effective_user
+    return f"@{user.username}" if user.username else str(user.id)
+
+def admin_required(handler=None, *, denial_message="❌ This command is restricted to admins."):
+    """Decorator for handlers that only admins may use.
+
+    Non-admins get denial_message as a reply, or are ignored silently if it is None.
+    """
+    if handler is None:
+        return lambda h: admin_required(h, denial_message=denial_message)
+
+    @wraps(handler)
+    async def wrapper(update, context):
+        if not is_admin(get_username(update)):
+            if denial_message:
+                await update.message.reply_text(denial_message)
+            return
+        return await handler(update, context)
+
+    return wrapper
 
 def add_admin(username):
     """Adds a new username to dynamic admins."""
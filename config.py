@@ -14,3 +14,9 @@ CREDENTIALS_FILE = "credentials.json"
 # Path to the token file (token.json)
 TOKEN_FILE = "token.json"
 
+# Chunk size for resumable Drive uploads (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+
+# Number of uploads processed in parallel
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 3))
+
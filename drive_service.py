@@ -1,15 +1,31 @@
 import os
 import io
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from config import CREDENTIALS_FILE, TOKEN_FILE
+from googleapiclient.http import MediaIoBaseUpload, build_http
+from config import CREDENTIALS_FILE, TOKEN_FILE, UPLOAD_CHUNK_SIZE
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+# Files smaller than this are sent in a single request instead of a resumable session.
+RESUMABLE_THRESHOLD = 25 * 1024 * 1024
+
+# Listing fields for duplicate detection; createdTime is needed because /removeall keeps the oldest copy
+FILE_LIST_FIELDS = 'nextPageToken, files(id, name, createdTime, md5Checksum, size)'
+
+# Built service and its credentials, reused until the token stops being valid.
+_service_cache = {'service': None, 'creds': None}
+
+# Serializes token refreshes; get_drive_service runs on executor threads.
+_refresh_lock = threading.Lock()
+
 class GoogleAuthError(Exception):
     """Custom exception for Google Drive authentication errors."""
     pass
@@ -20,9 +36,17 @@ def get_auth_flow():
         raise FileNotFoundError(f"Credentials file '{CREDENTIALS_FILE}' not found. Please download it from Google Cloud Console or set GDRIVE_CREDENTIALS env var.")
     return InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES, redirect_uri='urn:ietf:wg:oauth:2.0:oob')
 
+def invalidate_drive_service():
+    """Drops the cached Drive service so the next call rebuilds it."""
+    _service_cache['service'] = None
+    _service_cache['creds'] = None
+
 def get_drive_service():
     """Gets the Google Drive API service."""
-    
+    cached_creds = _service_cache['creds']
+    if _service_cache['service'] is not None and cached_creds and cached_creds.valid:
+        return _service_cache['service']
+
     # Heroku compatibility: Recreate credentials files from environment variables
     if not os.path.exists(CREDENTIALS_FILE) and "GDRIVE_CREDENTIALS" in os.environ:
         with open(CREDENTIALS_FILE, 'w') as f:
@@ -40,17 +64,69 @@ def get_drive_service():
     # If there are no (valid) credentials available, try to refresh or raise error
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-                # Save the refreshed credentials
-                with open(TOKEN_FILE, 'w') as token:
-                    token.write(creds.to_json())
-            except Exception as e:
-                raise GoogleAuthError(f"Failed to refresh token: {str(e)}")
+            with _refresh_lock:
+                # A concurrent caller may have refreshed the token while we waited
+                cached_creds = _service_cache['creds']
+                if _service_cache['service'] is not None and cached_creds and cached_creds.valid:
+                    print("Token already refreshed by another caller, reusing it.")
+                    return _service_cache['service']
+                creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+                if creds.valid:
+                    print("Token already refreshed by another caller, reusing it.")
+                else:
+                    invalidate_drive_service()
+                    try:
+                        print("Refreshing expired Drive token...")
+                        creds.refresh(Request())
+                        # Save the refreshed credentials
+                        with open(TOKEN_FILE, 'w') as token:
+                            token.write(creds.to_json())
+                    except Exception as e:
+                        raise GoogleAuthError(f"Failed to refresh token: {str(e)}")
         else:
             raise GoogleAuthError("No valid credentials found. Please use /reauth to authorize the bot.")
 
-    return build('drive', 'v3', credentials=creds)
+    service = build('drive', 'v3', credentials=creds)
+    _service_cache['service'] = service
+    _service_cache['creds'] = creds
+    return service
+
+def new_authorized_http():
+    """Builds a separate authorized HTTP client for the cached credentials.
+
+    httplib2 connections are not thread-safe, so each upload thread needs its own.
+    """
+    creds = _service_cache['creds']
+    if creds is None:
+        get_drive_service()
+        creds = _service_cache['creds']
+    # build_http() keeps googleapiclient's timeout and lets 308 Resume Incomplete through
+    return AuthorizedHttp(creds, http=build_http())
+
+def refresh_token_if_expiring(margin_seconds=300):
+    """Refreshes the token ahead of time if it expires within margin_seconds. Returns True if refreshed."""
+    with _refresh_lock:
+        # Read the current state under the lock; get_drive_service may have just refreshed and cached new creds
+        creds = _service_cache['creds']
+        from_file = creds is None
+        if from_file and os.path.exists(TOKEN_FILE):
+            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+        if not creds or not creds.refresh_token or not creds.expiry:
+            return False
+
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if creds.expiry - now > timedelta(seconds=margin_seconds):
+            return False
+
+        creds.refresh(Request())
+        with open(TOKEN_FILE, 'w') as token:
+            token.write(creds.to_json())
+        if from_file:
+            # Cache the refreshed creds so get_drive_service doesn't reload them from disk
+            _service_cache['service'] = build('drive', 'v3', credentials=creds)
+            _service_cache['creds'] = creds
+    return True
 
 def save_token(auth_code):
     """Initializes and saves token from auth code."""
@@ -59,16 +135,26 @@ def save_token(auth_code):
     creds = flow.credentials
     with open(TOKEN_FILE, 'w') as token:
         token.write(creds.to_json())
+    invalidate_drive_service()
     return True
 
-def upload_file(service, file_name, file_content, folder_id, mime_type='application/octet-stream', progress_callback=None, check_cancelled=None):
+def upload_file(service, file_name, file_content, folder_id, mime_type='application/octet-stream', progress_callback=None, check_cancelled=None, resumable=True):
     """Uploads a file to Google Drive."""
     file_metadata = {
         'name': file_name,
         'parents': [folder_id] if folder_id else []
     }
+    http = new_authorized_http()
     
-    media = MediaIoBaseUpload(file_content, mimetype=mime_type, resumable=True)
+    if not resumable:
+        # Small file: one request, no chunk loop or progress reporting
+        if check_cancelled and check_cancelled():
+            raise Exception("Upload cancelled by admin")
+        media = MediaIoBaseUpload(file_content, mimetype=mime_type, resumable=False)
+        response = service.files().create(body=file_metadata, media_body=media, fields='id').execute(http=http)
+        return response.get('id')
+
+    media = MediaIoBaseUpload(file_content, mimetype=mime_type, resumable=True, chunksize=UPLOAD_CHUNK_SIZE)
     request = service.files().create(body=file_metadata, media_body=media, fields='id')
     
     response = None
@@ -77,7 +163,7 @@ def upload_file(service, file_name, file_content, folder_id, mime_type='applicat
             raise Exception("Upload cancelled by admin")
             
         try:
-            status, response = request.next_chunk()
+            status, response = request.next_chunk(http=http)
             if status and progress_callback:
                 progress_callback(status.progress())
         except Exception as e:
@@ -95,7 +181,8 @@ def list_files_in_folder(service, folder_id):
             response = service.files().list(
                 q=f"'{folder_id}' in parents and trashed = false",
                 spaces='drive',
-                fields='nextPageToken, files(id, name, createdTime)',
+                fields=FILE_LIST_FIELDS,
+                pageSize=1000,
                 pageToken=page_token
             ).execute()
             files.extend(response.get('files', []))
@@ -108,20 +195,22 @@ def list_files_in_folder(service, folder_id):
     return files
 
 def find_duplicates(service, folder_id):
-    """Finds duplicate files in a folder based on NORMALIZED name match."""
+    """Finds duplicate files in a folder by content checksum, falling back to NORMALIZED name match."""
     files = list_files_in_folder(service, folder_id)
-    name_map = {}
+    name_map = defaultdict(list)
     
     for f in files:
-        # Normalize: Lowercase and strip whitespace
-        # This catches "File.txt " and "file.txt" as duplicates
-        norm_name = f['name'].strip().lower()
-        
-        if norm_name not in name_map:
-            name_map[norm_name] = []
-        name_map[norm_name].append(f)
+        # Drive only sets md5Checksum on binary content; Google Docs fall back to the name
+        md5 = f.get('md5Checksum')
+        if md5:
+            key = (md5, f.get('size'))
+        else:
+            # Normalize: Casefold and strip whitespace
+            # This catches "File.txt " and "file.txt" as duplicates
+            key = (f['name'].strip().casefold(), f.get('size'))
+        name_map[key].append(f)
     
-    # Filter for names with more than one file
+    # Filter for keys with more than one file
     duplicates = {name: items for name, items in name_map.items() if len(items) > 1}
     return duplicates
 
@@ -133,3 +222,22 @@ def delete_file(service, file_id):
     except Exception as e:
         print(f"Error deleting file {file_id}: {e}")
         return False
+
+def delete_files(service, file_ids, batch_size=100):
+    """Deletes files using batch requests. Returns the number of files deleted."""
+    deleted = 0
+
+    def callback(request_id, response, exception):
+        nonlocal deleted
+        if exception is not None:
+            print(f"Error deleting file {request_id}: {exception}")
+        else:
+            deleted += 1
+
+    # Drive accepts at most 100 calls per batch request
+    for i in range(0, len(file_ids), batch_size):
+        batch = service.new_batch_http_request(callback=callback)
+        for file_id in file_ids[i:i + batch_size]:
+            batch.add(service.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute()
+    return deleted
@@ -2,12 +2,13 @@ import logging
 import io
 import os
 import asyncio
+import time
 from telegram import Update, BotCommand
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
 from config import BOT_TOKEN, DRIVE_FOLDER_ID
-from drive_service import get_drive_service, find_duplicates, delete_file, GoogleAuthError, get_auth_flow, save_token
+from drive_service import find_duplicates, delete_files, GoogleAuthError, get_auth_flow, save_token
 from queue_manager import QueueManager
-from admin_utils import is_admin, add_admin, remove_admin
+from admin_utils import is_admin, add_admin, remove_admin, admin_required, get_username
 
 # Enable logging
 logging.basicConfig(
@@ -17,10 +18,12 @@ logging.basicConfig(
 
 queue_mgr = None
 
+# How long a /scan result can be reused by /removeall
+DUPLICATE_CACHE_TTL = 60
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a welcome message and resumes bot if admin."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
+    username = get_username(update)
     
     if is_admin(username) and queue_mgr.paused:
         await queue_mgr.resume_bot()
@@ -32,15 +35,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Send me any file, photo, or video, and I'll upload it to your Drive folder one by one."
     )
 
+@admin_required
 async def pause_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Pauses the bot and clears all tasks (Admin only)."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
-        return
-
     await update.message.reply_text("⏳ Pausing bot and clearing all tasks... Please wait.")
     cancelled_count = await queue_mgr.pause_bot()
     
@@ -53,15 +50,10 @@ async def pause_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+@admin_required(denial_message="❌ Only admins can upload files to Google Drive.")
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles file uploads by adding them to the queue."""
     message = update.message
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await message.reply_text("❌ Only admins can upload files to Google Drive.")
-        return
 
     file = None
     file_name = None
@@ -92,15 +84,9 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await queue_mgr.add_job(update, context, file_info)
 
+@admin_required
 async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Adds a new admin (Admin only)."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
-        return
-
     if not context.args:
         await update.message.reply_text("Usage: /addadmin <username>")
         return
@@ -109,15 +95,9 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     success, msg = add_admin(target_user)
     await update.message.reply_text(f"{'✅' if success else '❌'} {msg}")
 
+@admin_required
 async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Removes an admin (Admin only)."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
-        return
-
     if not context.args:
         await update.message.reply_text("Usage: /removeadmin <username>")
         return
@@ -126,28 +106,23 @@ async def remove_admin_command(update: Update, context: ContextTypes.DEFAULT_TYP
     success, msg = remove_admin(target_user)
     await update.message.reply_text(f"{'✅' if success else '❌'} {msg}")
 
+@admin_required
 async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Scans for duplicate files in the Drive folder."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
-        return
-
     await update.message.reply_text("🔍 Scanning for duplicates... This may take a while.")
     
     loop = asyncio.get_running_loop()
     try:
-        service = await loop.run_in_executor(None, get_drive_service)
-        duplicates = await loop.run_in_executor(None, find_duplicates, service, DRIVE_FOLDER_ID)
+        service = await queue_mgr.get_service()
+        duplicates = await loop.run_in_executor(queue_mgr.control_pool, find_duplicates, service, DRIVE_FOLDER_ID)
+        queue_mgr.duplicate_cache = {'folder_id': DRIVE_FOLDER_ID, 'timestamp': time.time(), 'duplicates': duplicates}
         
         if not duplicates:
             await update.message.reply_text("✅ No duplicate files found.")
             return
 
-        msg = f"Found {len(duplicates)} sets of duplicates (Name-Based):\n\n"
-        for norm_name, files in duplicates.items():
+        msg = f"Found {len(duplicates)} sets of duplicates (Content/Name-Based):\n\n"
+        for key, files in duplicates.items():
             # Use the name from the first file as the display name
             display_name = files[0]['name']
             msg += f"• `{display_name}`: {len(files)} copies\n"
@@ -162,15 +137,9 @@ async def scan_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             await update.message.reply_text(f"❌ Error during scan: `{str(e)}`", parse_mode='Markdown')
 
+@admin_required
 async def reauth_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generates a re-authorization URL (Admin only)."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
-        return
-
     try:
         flow = get_auth_flow()
         auth_url, _ = flow.authorization_url(prompt='consent')
@@ -189,55 +158,55 @@ async def reauth_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles text messages, potentially authorization codes."""
     text = update.message.text.strip()
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
-
-    # Simple check if it might be an auth code (usually long, no spaces)
-    if is_admin(username) and len(text) > 30 and ' ' not in text:
-        status_msg = await update.message.reply_text("⏳ Verifying authorization code...")
-        try:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, save_token, text)
-            await status_msg.edit_text("✅ **Authorization Successful!**\nYou can now resume uploads or use /scan.")
-        except Exception as e:
-            await status_msg.edit_text(f"❌ **Authorization Failed:**\n{str(e)}\n\nMake sure you copied the full code and try again.")
-        return
-
-    # If not an auth code, just ignore or add more text handling here
 
-async def remove_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Removes all duplicate files based on name, keeping the oldest one."""
-    user = update.effective_user
-    username = f"@{user.username}" if user.username else str(user.id)
+    # Simple check if it might be an auth code (usually long, no spaces).
+    # Done before the admin check so ordinary chat is rejected as cheaply as possible.
+    if ' ' in text or len(text) <= 30:
+        return
 
-    if not is_admin(username):
-        await update.message.reply_text("❌ This command is restricted to admins.")
+    if not is_admin(get_username(update)):
         return
 
-    await update.message.reply_text("🗑️ Duplicate removal (Name-Based) started... This may take a while.")
+    status_msg = await update.message.reply_text("⏳ Verifying authorization code...")
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(queue_mgr.control_pool, save_token, text)
+        queue_mgr.invalidate_duplicate_cache()
+        await status_msg.edit_text("✅ **Authorization Successful!**\nYou can now resume uploads or use /scan.")
+    except Exception as e:
+        await status_msg.edit_text(f"❌ **Authorization Failed:**\n{str(e)}\n\nMake sure you copied the full code and try again.")
+
+@admin_required
+async def remove_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Removes all duplicate files (by content or name), keeping the oldest one."""
+    await update.message.reply_text("🗑️ Duplicate removal (Content/Name-Based) started... This may take a while.")
     
     loop = asyncio.get_running_loop()
     try:
-        service = await loop.run_in_executor(None, get_drive_service)
-        duplicates = await loop.run_in_executor(None, find_duplicates, service, DRIVE_FOLDER_ID)
+        service = await queue_mgr.get_service()
+        cache = queue_mgr.duplicate_cache
+        cache_age = time.time() - cache['timestamp']
+        if cache['folder_id'] == DRIVE_FOLDER_ID and cache['duplicates'] is not None and cache_age < DUPLICATE_CACHE_TTL:
+            duplicates = cache['duplicates']
+            await update.message.reply_text(f"♻️ Using cached scan from {int(cache_age)}s ago.")
+        else:
+            duplicates = await loop.run_in_executor(queue_mgr.control_pool, find_duplicates, service, DRIVE_FOLDER_ID)
+        queue_mgr.invalidate_duplicate_cache()
         
         if not duplicates:
             await update.message.reply_text("✅ No duplicate files found to remove.")
             return
             
-        total_deleted = 0
+        to_delete = []
         
-        for norm_name, files in duplicates.items():
+        for key, files in duplicates.items():
             # Sort by createdTime (oldest first)
             files.sort(key=lambda x: x['createdTime'])
             
             # Keep the first one (index 0), delete the rest
-            to_delete = files[1:]
+            to_delete.extend(file['id'] for file in files[1:])
             
-            for file in to_delete:
-                success = await loop.run_in_executor(None, delete_file, service, file['id'])
-                if success:
-                    total_deleted += 1
+        total_deleted = await loop.run_in_executor(queue_mgr.control_pool, delete_files, service, to_delete)
                     
         await update.message.reply_text(f"✅ Removal complete.\nDeleted {total_deleted} duplicate files. Originals kept.")
     except Exception as e:
@@ -264,7 +233,7 @@ async def post_init(application):
     # Trigger Google Drive authorization
     try:
         print("Checking Google Drive authorization...")
-        get_drive_service()
+        await queue_mgr.get_service()
         print("Google Drive authorization successful!")
     except Exception as e:
         print(f"Google Drive authorization failed or pending: {e}")
@@ -1,21 +1,65 @@
 import asyncio
-import io
 import logging
+import os
+import tempfile
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from drive_service import get_drive_service, upload_file, GoogleAuthError
-from config import DRIVE_FOLDER_ID
+from drive_service import get_drive_service, upload_file, refresh_token_if_expiring, GoogleAuthError, RESUMABLE_THRESHOLD
+from config import DRIVE_FOLDER_ID, UPLOAD_WORKERS
 
 logger = logging.getLogger(__name__)
 
+TOKEN_CHECK_INTERVAL = 60
+TOKEN_REFRESH_MARGIN = 5 * 60
+# Queued in place of a job to tell an idle worker to exit
+_SHUTDOWN = object()
+
 class QueueManager:
     def __init__(self, application):
         self.application = application
-        self.queue = asyncio.Queue()
-        self.is_processing = False
+        self.queue = deque()
+        self.queue_event = asyncio.Event()
         self.paused = False
-        self.worker_task = None
-        self.last_update_time = {}
+        self.worker_tasks = []
+        self.active_tasks = set()
+        # Dedicated threads so long-running uploads can't starve control calls like /scan or token refresh
+        self.upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='drive-upload')
+        self.control_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='drive-ctl')
+        # Only one caller builds the Drive service; the rest then hit get_drive_service's cache
+        self.service_lock = asyncio.Lock()
+        self.duplicate_cache = {'folder_id': None, 'timestamp': 0, 'duplicates': None}
+        self.token_refresher_task = asyncio.create_task(self._token_refresher())
+        self._start_workers()
+
+    def _start_workers(self):
+        """Spawns the upload worker tasks."""
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(UPLOAD_WORKERS)]
+
+    async def _token_refresher(self):
+        """Refreshes the Drive token in the background before it expires."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                refreshed = await loop.run_in_executor(self.control_pool, refresh_token_if_expiring, TOKEN_REFRESH_MARGIN)
+                if refreshed:
+                    logger.info("Drive token refreshed ahead of expiry.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Background token refresh failed: {e}")
+            await asyncio.sleep(TOKEN_CHECK_INTERVAL)
+
+    async def get_service(self):
+        """Returns the Drive service, going through get_drive_service's cache and refresh handling."""
+        loop = asyncio.get_running_loop()
+        async with self.service_lock:
+            return await loop.run_in_executor(self.control_pool, get_drive_service)
+
+    def invalidate_duplicate_cache(self):
+        """Forgets the last duplicate scan."""
+        self.duplicate_cache = {'folder_id': None, 'timestamp': 0, 'duplicates': None}
 
     async def add_job(self, update, context, file_info):
         """Adds a job to the queue."""
@@ -30,66 +74,84 @@ class QueueManager:
             'file_info': file_info,
             'status_message': status_message,
             'start_time': time.time(),
-            'user_id': update.effective_user.id
+            'user_id': update.effective_user.id,
+            'last_rendered_position': None,
+            'cancelled': False
         }
-        await self.queue.put(job)
+        self.queue.append(job)
+        self.queue_event.set()
         
-        # If not processing, start the worker
-        if not self.is_processing:
-            self.worker_task = asyncio.create_task(self.worker())
-        else:
-            # Show queue position
+        # Show queue position if every worker is already busy
+        if len(self.active_tasks) >= UPLOAD_WORKERS:
             await self.update_queue_status()
 
     async def pause_bot(self):
-        """Pauses the bot, clears the queue, and cancels the current task."""
+        """Pauses the bot, clears the queue, and stops all workers."""
         self.paused = True
         
-        # Clear the queue and notify users
-        cancelled_count = 0
-        while not self.queue.empty():
-            job = await self.queue.get()
+        # Take every queued job at once so no worker can pick one up meanwhile
+        cancelled_jobs = list(self.queue)
+        self.queue.clear()
+
+        # Force-stop busy workers; idle ones exit when they receive a shutdown sentinel
+        for task in self.active_tasks:
+            task.cancel()
+        idle_count = sum(1 for task in self.worker_tasks if task not in self.active_tasks and not task.done())
+        self.queue.extend([_SHUTDOWN] * idle_count)
+        self.queue_event.set()
+
+        # Notify users
+        for job in cancelled_jobs:
             try:
                 await job['status_message'].edit_text("🛑 This task was cancelled because the bot was paused by an admin.")
             except Exception:
                 pass
-            self.queue.task_done()
-            cancelled_count += 1
-            
-        # Cancel the current worker task
-        if self.worker_task and not self.worker_task.done():
-            self.worker_task.cancel()
+
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
             
-        return cancelled_count
+        return len(cancelled_jobs)
 
     async def resume_bot(self):
         """Resumes the bot."""
         self.paused = False
+        if not self.worker_tasks:
+            self._start_workers()
 
     async def update_queue_status(self):
-        """Updates the status of all queued jobs with their position."""
-        temp_list = []
-        while not self.queue.empty():
-            temp_list.append(await self.queue.get())
-        
-        for i, job in enumerate(temp_list):
+        """Updates the status of queued jobs whose position has changed."""
+        # Snapshot, since the deque may change while we await the edits
+        for i, job in enumerate(list(self.queue)):
+            if job is _SHUTDOWN:
+                continue
+            position = i + 1
+            if job['last_rendered_position'] == position:
+                continue
+            job['last_rendered_position'] = position
             try:
-                position = i + 1
                 await job['status_message'].edit_text(f"Queued... Position in line: {position}")
             except Exception:
                 pass
-            await self.queue.put(job)
 
     async def worker(self):
-        """Background worker to process jobs one by one."""
-        self.is_processing = True
+        """Background worker that processes jobs one by one; several run in parallel."""
         try:
-            while not self.queue.empty() and not self.paused:
-                job = await self.queue.get()
+            while True:
+                if not self.queue:
+                    self.queue_event.clear()
+                    await self.queue_event.wait()
+                    continue
+                job = self.queue.popleft()
+                if job is _SHUTDOWN:
+                    break
+                task = asyncio.current_task()
+                self.active_tasks.add(task)
                 try:
                     await self.process_job(job)
                 except asyncio.CancelledError:
                     logger.info("Worker task cancelled.")
+                    # Stop the upload thread even if the bot is resumed before it notices the pause
+                    job['cancelled'] = True
                     try:
                         await job['status_message'].edit_text("🛑 This task was force-stopped by an admin.")
                     except Exception:
@@ -102,14 +164,11 @@ class QueueManager:
                     except Exception:
                         pass
                 finally:
-                    self.queue.task_done()
+                    self.active_tasks.discard(task)
                     # Update remaining jobs' positions
                     await self.update_queue_status()
         except asyncio.CancelledError:
             logger.info("Worker loop cancelled.")
-        finally:
-            self.is_processing = False
-            self.worker_task = None
 
     async def process_job(self, job):
         """Processes a single upload job."""
@@ -124,23 +183,25 @@ class QueueManager:
 
         await status_message.edit_text(f"Downloading {file_name}...")
         
-        # Download with progress
-        file_content = io.BytesIO()
-        await tg_file.download_to_memory(file_content)
-        file_content.seek(0)
-        
-        await status_message.edit_text(f"Uploading {file_name} to Google Drive...")
-
+        # Download straight to disk so the file is never held in memory
+        fd, tmp_path = tempfile.mkstemp(prefix='upload_')
+        os.close(fd)
+        file_content = None
         try:
-            service = get_drive_service()
-            loop = asyncio.get_running_loop()
-            
-            async def progress_callback_async(progress):
-                percent = int(progress * 100)
-                message_id = status_message.message_id
-                now = time.time()
-                if message_id not in self.last_update_time or now - self.last_update_time[message_id] > 2:
-                    self.last_update_time[message_id] = now
+            await tg_file.download_to_drive(custom_path=tmp_path)
+            file_size = os.path.getsize(tmp_path)
+            file_content = open(tmp_path, 'rb')
+
+            await status_message.edit_text(f"Uploading {file_name} to Google Drive...")
+
+            try:
+                service = await self.get_service()
+                loop = asyncio.get_running_loop()
+                
+                last_percent = None
+                last_update_time = 0.0
+
+                async def progress_callback_async(percent):
                     try:
                         filled = int(percent / 10)
                         bar = "█" * filled + "░" * (10 - filled)
@@ -148,39 +209,50 @@ class QueueManager:
                     except Exception:
                         pass
 
-            def progress_callback_sync(p):
-                asyncio.run_coroutine_threadsafe(progress_callback_async(p), loop)
-
-            def check_cancelled():
-                return self.paused
-
-            # Use partial to pass progress_callback_sync explicitly
-            upload_func = partial(
-                upload_file,
-                service, 
-                file_name, 
-                file_content, 
-                DRIVE_FOLDER_ID, 
-                mime_type=mime_type,
-                progress_callback=progress_callback_sync,
-                check_cancelled=check_cancelled
-            )
-
-            file_id = await loop.run_in_executor(None, upload_func)
-
-            # Final update
-            await asyncio.sleep(0.5)
-            await status_message.edit_text(f"✅ Successfully uploaded!\nFile: `{file_name}`\nID: `{file_id}`", parse_mode='Markdown')
-            
-        except Exception as e:
-            if "cancelled by admin" in str(e).lower():
-                logger.info(f"Upload of {file_name} cancelled by admin.")
-                # The worker will handle the status message update if it was a CancelledError
-                # but here it's an Exception raised within the executor.
-                raise asyncio.CancelledError() from e
-            if isinstance(e, GoogleAuthError):
-                await status_message.edit_text(f"❌ **Drive Auth Error:**\n`{str(e)}`\n\nUse /reauth to fix this.", parse_mode='Markdown')
-            else:
-                await status_message.edit_text(f"❌ **Upload failed:**\n`{str(e)}`", parse_mode='Markdown')
+                def progress_callback_sync(p):
+                    # Throttle here, in the upload thread, so skipped updates never reach the event loop
+                    nonlocal last_percent, last_update_time
+                    percent = int(p * 100)
+                    now = time.time()
+                    if percent == last_percent or now - last_update_time < 2.0:
+                        return
+                    last_percent = percent
+                    last_update_time = now
+                    asyncio.run_coroutine_threadsafe(progress_callback_async(percent), loop)
+
+                def check_cancelled():
+                    return self.paused or job['cancelled']
+
+                # Use partial to pass progress_callback_sync explicitly
+                upload_func = partial(
+                    upload_file,
+                    service, 
+                    file_name, 
+                    file_content, 
+                    DRIVE_FOLDER_ID, 
+                    mime_type=mime_type,
+                    progress_callback=progress_callback_sync,
+                    check_cancelled=check_cancelled,
+                    resumable=file_size >= RESUMABLE_THRESHOLD
+                )
+
+                file_id = await loop.run_in_executor(self.upload_pool, upload_func)
+
+                # Final update
+                await asyncio.sleep(0.5)
+                await status_message.edit_text(f"✅ Successfully uploaded!\nFile: `{file_name}`\nID: `{file_id}`", parse_mode='Markdown')
+                
+            except Exception as e:
+                if "cancelled by admin" in str(e).lower():
+                    logger.info(f"Upload of {file_name} cancelled by admin.")
+                    # The worker will handle the status message update if it was a CancelledError
+                    # but here it's an Exception raised within the executor.
+                    raise asyncio.CancelledError() from e
+                if isinstance(e, GoogleAuthError):
+                    await status_message.edit_text(f"❌ **Drive Auth Error:**\n`{str(e)}`\n\nUse /reauth to fix this.", parse_mode='Markdown')
+                else:
+                    await status_message.edit_text(f"❌ **Upload failed:**\n`{str(e)}`", parse_mode='Markdown')
         finally:
-            self.last_update_time.pop(status_message.message_id, None)
+            if file_content:
+                file_content.close()
+            os.remove(tmp_path)